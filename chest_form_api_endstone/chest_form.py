@@ -5,13 +5,14 @@
 #
 # SPDX-License-Identifier: MPL-2.0
 
+from functools import partial
 from uuid import UUID
-from typing import Dict, Callable, Optional, List
+from typing import Dict, Callable, Optional, List, Tuple
 from endstone import Player
 from endstone.inventory import ItemStack
 from endstone.plugin import Plugin
 from endstone.level import Dimension
-from endstone.event import PacketReceiveEvent, EventPriority
+from endstone.event import PacketReceiveEvent, PlayerQuitEvent, EventPriority
 from rapidnbt import CompoundTag, ByteTag, ShortTag
 from bedrock_protocol.packets.packet import (
     UpdateBlockPacket,
@@ -25,6 +26,17 @@ from bedrock_protocol.packets.enums import ItemStackRequestActionType
 from bedrock_protocol.packets.types import NetworkBlockPosition
 import endstone.nbt
 
+_TAKE_ACTION = int(ItemStackRequestActionType.Take)
+
+_DIMENSION_MAX_Y = {
+    Dimension.Type.OVERWORLD: 319,
+    Dimension.Type.NETHER: 127,
+    Dimension.Type.THE_END: 255,
+}
+
+# Shared placeholder for empty slots; treated as immutable and never written to.
+_EMPTY_ITEM_NBT = CompoundTag()
+
 
 class ChestForm:
     """
@@ -33,9 +45,11 @@ class ChestForm:
 
     title: str
     large_chest: bool
-    ui_items: Dict[int, CompoundTag]
+    ui_items: List[CompoundTag]
     call_backs: Dict[int, Callable[[Player, int], None]]
     plugin: Plugin
+    _block_actor_cache: Optional[Tuple[CompoundTag, Optional[CompoundTag]]]
+    _dirty: bool
 
     def __init__(self, plugin: Plugin, title: str = "ChestUI", large_chest=True):
         """
@@ -49,31 +63,12 @@ class ChestForm:
 
         self.title = title
         self.large_chest = large_chest
-        self.ui_items = {}
+        self.ui_items = [_EMPTY_ITEM_NBT] * 54
         self.call_backs = {}
-        if not hasattr(plugin, "__chest_form_api_listener"):
-
-            def on_incoming_packet(event: PacketReceiveEvent):
-                if event.packet_id == MinecraftPacketIds.ItemStackRequest:
-                    ChestFormCallbackHandler.handle_chest_callback(
-                        event.player, event.payload
-                    )
-                elif event.packet_id == MinecraftPacketIds.ContainerClose:
-                    ChestFormCallbackHandler.handle_chest_close(
-                        event.player, event.payload
-                    )
-
-            plugin.server.plugin_manager.register_event(
-                "PacketReceiveEvent",
-                on_incoming_packet,
-                EventPriority.NORMAL,
-                plugin,
-                False,
-            )
-            setattr(plugin, "__chest_form_api_listener", True)
+        self._block_actor_cache = None
+        self._dirty = True
+        register_chest_form_listener(plugin)
         self.plugin = plugin
-        for index in range(54):
-            set_form_slot(self, index, None, None)
 
     def set_title(self, title: str) -> None:
         """
@@ -83,7 +78,10 @@ class ChestForm:
             title (str): The title of the chest sent to client
         """
 
+        if title == self.title:
+            return
         self.title = title
+        self._dirty = True
 
     def set_slot(
         self,
@@ -150,18 +148,38 @@ class ChestForm:
             enchants (Optional[Dict[str, int]]): The enchantments on the item (ingore vanilla limit)
         """
 
-        for index in range(54):
-            self.set_slot(
-                index,
-                item_type,
-                None,
-                item_amount=item_amount,
-                item_data=item_data,
-                display_name=display_name,
-                lore=lore,
-                enchants=enchants,
-                nbt=nbt,
+        item = ItemStack(item_type, item_amount, item_data)
+        meta = item.item_meta
+        if display_name is not None:
+            meta.display_name = display_name
+        if lore is not None:
+            meta.lore = lore
+        if enchants is not None:
+            for name, level in enchants.items():
+                meta.add_enchant(name, level, True)
+        item.set_item_meta(meta)
+        if nbt is not None:
+            item.nbt = nbt
+        count = ByteTag(item.amount)
+        damage = ShortTag(item.data)
+        type_id = item.type.id
+        tag = build_item_tag(item)
+        for slot in range(27):
+            item_nbt = CompoundTag(
+                {
+                    "Count": count,
+                    "Damage": damage,
+                    "Name": type_id,
+                    "WasPickedUp": False,
+                    "Slot": ByteTag(slot),
+                }
             )
+            if tag is not None:
+                item_nbt["tag"] = tag
+            self.ui_items[slot] = item_nbt
+            self.ui_items[slot + 27] = item_nbt
+        self.call_backs.clear()
+        self._dirty = True
 
     def send_to(self, player: Player) -> None:
         """
@@ -171,30 +189,24 @@ class ChestForm:
             player (Player): The player who receive the form
         """
 
-        x = player.location.block_x
-        y = player.location.block_y + 4
-        z = player.location.block_z
-        d = player.location.dimension.type
-        if (
-            (d == Dimension.Type.OVERWORLD and y > 319)
-            or (d == Dimension.Type.NETHER and y > 127)
-            or (d == Dimension.Type.THE_END and y > 255)
-        ):
-            y = player.location.block_y - 3
-
-        update_chest_block(self, player, x, y, z, False)
-        update_chest_block_actor(self, player, x, y, z)
-
-        def open_chest():
-            player.send_packet(
+        location = player.location
+        x = location.block_x
+        y = location.block_y + 4
+        z = location.block_z
+        if y > _DIMENSION_MAX_Y.get(location.dimension.type, 255):
+            y = location.block_y - 3
+
+        data = FormData(self, x, y, z)
+        packets = build_chest_block_packets(player, data, False)
+        packets += build_chest_block_actor_packets(data)
+        packets.append(
+            (
                 MinecraftPacketIds.ContainerOpen,
-                ContainerOpenPacket(
-                    114, 0, NetworkBlockPosition(x, y, z), -1
-                ).serialize(),
+                ContainerOpenPacket(114, 0, data.pos, -1).serialize(),
             )
-            ChestFormCallbackHandler.add_runtime_form(player, FormData(self, x, y, z))
-
-        run_delay_task(open_chest, 10, self.plugin)
+        )
+        send_packet_batch(player, packets)
+        ChestFormCallbackHandler.add_runtime_form(player, data)
 
 
 class FormData:
@@ -202,12 +214,18 @@ class FormData:
     x: int
     y: int
     z: int
+    pos: NetworkBlockPosition
+    pair_pos: Optional[NetworkBlockPosition]
 
     def __init__(self, form: ChestForm, x: int, y: int, z: int):
         self.form = form
         self.x = x
         self.y = y
         self.z = z
+        self.pos = NetworkBlockPosition(x, y, z)
+        self.pair_pos = (
+            NetworkBlockPosition(x + 1, y, z) if form.large_chest else None
+        )
 
 
 class ChestFormCallbackHandler:
@@ -218,46 +236,104 @@ class ChestFormCallbackHandler:
         cls.runtime_forms[player.unique_id] = data
 
     @classmethod
-    def handle_chest_callback(cls, player: Player, payload: bytes):
-        packet = ItemStackRequestPacket()
-        packet.deserialize(payload)
+    def remove_runtime_form(cls, player: Player):
+        cls.runtime_forms.pop(player.unique_id, None)
+
+    @classmethod
+    def handle_chest_callback(
+        cls,
+        player: Player,
+        payload: bytes,
+        _ItemStackRequestPacket=ItemStackRequestPacket,
+        _ContainerClosePacket=ContainerClosePacket,
+        _ContainerClose=MinecraftPacketIds.ContainerClose,
+    ):
+        runtime_forms = cls.runtime_forms
         uuid = player.unique_id
-        if uuid in cls.runtime_forms:
-            data = cls.runtime_forms[uuid]
-            form = data.form
-            for req in packet.request.request_data:
-                for action in req.request_actions:
-                    if (action.action_type == ItemStackRequestActionType.Take) and (
-                        action.action_data.source.net_id == 0
-                    ):
-                        index = action.action_data.source.slot
-                        if index in form.call_backs:
-                            player.send_packet(
-                                MinecraftPacketIds.ContainerClose,
-                                ContainerClosePacket(114, 0, True).serialize(),
-                            )
-                            update_chest_block(
-                                form, player, data.x, data.y, data.z, True
-                            )
-                            del cls.runtime_forms[uuid]
-                            run_delay_task(
-                                lambda: form.call_backs[index](player, index),
-                                2,
-                                form.plugin,
-                            )
-                            return
+        data = runtime_forms.get(uuid)
+        if data is None:
+            return
+        packet = _ItemStackRequestPacket()
+        packet.deserialize(payload)
+        form = data.form
+        call_backs = form.call_backs
+        for req in packet.request.request_data:
+            for action in req.request_actions:
+                if action.action_type != _TAKE_ACTION:
+                    continue
+                source = action.action_data.source
+                if source.net_id != 0:
+                    continue
+                index = source.slot
+                if index in call_backs:
+                    packets = [
+                        (
+                            _ContainerClose,
+                            _ContainerClosePacket(114, 0, True).serialize(),
+                        )
+                    ]
+                    packets += build_chest_block_packets(player, data, True)
+                    send_packet_batch(player, packets)
+                    del runtime_forms[uuid]
+                    run_delay_task(
+                        partial(call_backs[index], player, index),
+                        2,
+                        form.plugin,
+                    )
+                    return
 
     @classmethod
-    def handle_chest_close(cls, player: Player, payload: bytes):
-        packet = ContainerClosePacket()
+    def handle_chest_close(
+        cls,
+        player: Player,
+        payload: bytes,
+        _ContainerClosePacket=ContainerClosePacket,
+    ):
+        packet = _ContainerClosePacket()
         packet.deserialize(payload)
+        if packet.container_id != 114:
+            return
+        runtime_forms = cls.runtime_forms
         uuid = player.unique_id
-        if packet.container_id == 114:
-            if uuid in cls.runtime_forms:
-                data = cls.runtime_forms[uuid]
-                form = data.form
-                update_chest_block(form, player, data.x, data.y, data.z, True)
-                del cls.runtime_forms[uuid]
+        data = runtime_forms.get(uuid)
+        if data is None:
+            return
+        send_packet_batch(player, build_chest_block_packets(player, data, True))
+        del runtime_forms[uuid]
+
+
+_listener_registered = False
+
+
+def register_chest_form_listener(plugin: Plugin) -> None:
+    global _listener_registered
+    if _listener_registered:
+        return
+
+    def on_incoming_packet(event: PacketReceiveEvent):
+        if event.packet_id == MinecraftPacketIds.ItemStackRequest:
+            ChestFormCallbackHandler.handle_chest_callback(event.player, event.payload)
+        elif event.packet_id == MinecraftPacketIds.ContainerClose:
+            ChestFormCallbackHandler.handle_chest_close(event.player, event.payload)
+
+    def on_player_quit(event: PlayerQuitEvent):
+        ChestFormCallbackHandler.remove_runtime_form(event.player)
+
+    plugin.server.plugin_manager.register_event(
+        "PacketReceiveEvent",
+        on_incoming_packet,
+        EventPriority.NORMAL,
+        plugin,
+        False,
+    )
+    plugin.server.plugin_manager.register_event(
+        "PlayerQuitEvent",
+        on_player_quit,
+        EventPriority.NORMAL,
+        plugin,
+        False,
+    )
+    _listener_registered = True
 
 
 ENCHANTMENTS_MAP = {
@@ -305,6 +381,35 @@ ENCHANTMENTS_MAP = {
     "lunge": 41,
 }
 
+_ENCHANTMENT_ID_TAGS = {
+    name: ShortTag(value) for name, value in ENCHANTMENTS_MAP.items()
+}
+
+
+def build_item_tag(item: ItemStack) -> Optional[CompoundTag]:
+    meta = item.item_meta
+    has_name = meta.has_display_name
+    has_lore = meta.has_lore
+    has_ench = meta.has_enchants
+    if not (has_name or has_lore or has_ench):
+        return None
+    tag = CompoundTag()
+    if has_name or has_lore:
+        display = {}
+        if has_name:
+            display["Name"] = meta.display_name
+        if has_lore:
+            display["Lore"] = meta.lore
+        tag["display"] = CompoundTag(display)
+    if has_ench:
+        ench_list = []
+        for name, level in meta.enchants.items():
+            id_tag = _ENCHANTMENT_ID_TAGS.get(name)
+            if id_tag is not None:
+                ench_list.append({"id": id_tag, "lvl": ShortTag(level)})
+        tag["ench"] = ench_list
+    return tag
+
 
 def set_form_slot(
     form: ChestForm,
@@ -312,8 +417,11 @@ def set_form_slot(
     item: ItemStack,
     callback: Optional[Callable[[Player, int], None]],
 ):
-    item_nbt = CompoundTag()
-    if item is not None:
+    if item is None:
+        if form.ui_items[index] is not _EMPTY_ITEM_NBT:
+            form.ui_items[index] = _EMPTY_ITEM_NBT
+            form._dirty = True
+    else:
         slot = index
         if slot >= 27:
             slot -= 27
@@ -326,86 +434,128 @@ def set_form_slot(
                 "Slot": ByteTag(slot),
             }
         )
-        tag = CompoundTag()
-        if item.item_meta.has_display_name:
-            tag["display"]["Name"] = item.item_meta.display_name
-        if item.item_meta.has_lore:
-            tag["display"]["Lore"] = item.item_meta.lore
-        if item.item_meta.has_enchants:
-            tag["ench"] = []
-            for name, level in item.item_meta.enchants.items():
-                if name in ENCHANTMENTS_MAP:
-                    ench = ENCHANTMENTS_MAP[name]
-                    tag["ench"].append({"id": ShortTag(ench), "lvl": ShortTag(level)})
-        if not tag.empty():
+        tag = build_item_tag(item)
+        if tag is not None:
             item_nbt["tag"] = tag
-    form.ui_items[index] = item_nbt
+        form.ui_items[index] = item_nbt
+        form._dirty = True
     if callback is not None:
         form.call_backs[index] = callback
 
 
-def update_chest_block(
-    form: ChestForm, player: Player, x: int, y: int, z: int, is_close: bool
-) -> None:
+def build_chest_block_packets(
+    player: Player, data: FormData, is_close: bool
+) -> List[Tuple[MinecraftPacketIds, bytes]]:
+    x = data.x
+    y = data.y
+    z = data.z
     block_runtime_id = 741882976  # hash runtime id for minecraft:chest
     if is_close:
         block_runtime_id = player.dimension.get_block_at(x, y, z).data.runtime_id
-    player.send_packet(
-        MinecraftPacketIds.UpdateBlock,
-        UpdateBlockPacket(
-            NetworkBlockPosition(x, y, z), block_runtime_id, 3, 0
-        ).serialize(),
-    )
-    if form.large_chest:
+    packets = [
+        (
+            MinecraftPacketIds.UpdateBlock,
+            UpdateBlockPacket(data.pos, block_runtime_id, 3, 0).serialize(),
+        )
+    ]
+    if data.form.large_chest:
         if is_close:
             block_runtime_id = player.dimension.get_block_at(
                 x + 1, y, z
             ).data.runtime_id
-        player.send_packet(
-            MinecraftPacketIds.UpdateBlock,
-            UpdateBlockPacket(
-                NetworkBlockPosition(x + 1, y, z), block_runtime_id, 3, 0
-            ).serialize(),
+        packets.append(
+            (
+                MinecraftPacketIds.UpdateBlock,
+                UpdateBlockPacket(data.pair_pos, block_runtime_id, 3, 0).serialize(),
+            )
         )
+    return packets
 
 
-def update_chest_block_actor(
-    form: ChestForm, player: Player, x: int, y: int, z: int
-) -> None:
-    block_nbt = CompoundTag(
-        {
-            "CustomName": form.title,
-            "Findable": False,
-            "id": "Chest",
-            "isMovable": True,
-            "x": x,
-            "y": y,
-            "z": z,
-            "pairx": x + 1,
-            "pairz": z,
-            "pairlead": True,
-            "Items": [],
-        }
-    )
-    for index in range(27):
-        block_nbt["Items"].append(form.ui_items[index])
-    player.send_packet(
-        MinecraftPacketIds.BlockActorData,
-        BlockActorDataPacket(NetworkBlockPosition(x, y, z), block_nbt).serialize(),
-    )
-    if form.large_chest:
-        block_nbt["x"] = x + 1
-        block_nbt["pairx"] = x
-        block_nbt["pairlead"] = False
-        block_nbt["Items"].clear()
-        for index in range(27):
-            block_nbt["Items"].append(form.ui_items[index + 27])
-        player.send_packet(
+def build_chest_form_actor_tags(
+    form: ChestForm,
+) -> Tuple[CompoundTag, Optional[CompoundTag]]:
+    if form._dirty or form._block_actor_cache is None:
+        items = form.ui_items
+        block_nbt = CompoundTag(
+            {
+                "CustomName": form.title,
+                "Findable": False,
+                "id": "Chest",
+                "isMovable": True,
+                "x": 0,
+                "y": 0,
+                "z": 0,
+                "pairx": 0,
+                "pairz": 0,
+                "pairlead": True,
+                "Items": items[:27],
+            }
+        )
+        pair_nbt = None
+        if form.large_chest:
+            pair_nbt = CompoundTag(
+                {
+                    "CustomName": form.title,
+                    "Findable": False,
+                    "id": "Chest",
+                    "isMovable": True,
+                    "x": 0,
+                    "y": 0,
+                    "z": 0,
+                    "pairx": 0,
+                    "pairz": 0,
+                    "pairlead": False,
+                    "Items": items[27:],
+                }
+            )
+        form._block_actor_cache = (block_nbt, pair_nbt)
+        form._dirty = False
+    return form._block_actor_cache
+
+
+def build_chest_block_actor_packets(
+    data: FormData,
+) -> List[Tuple[MinecraftPacketIds, bytes]]:
+    x = data.x
+    y = data.y
+    z = data.z
+    block_nbt, pair_nbt = build_chest_form_actor_tags(data.form)
+    block_nbt["x"] = x
+    block_nbt["y"] = y
+    block_nbt["z"] = z
+    block_nbt["pairx"] = x + 1
+    block_nbt["pairz"] = z
+    packets = [
+        (
             MinecraftPacketIds.BlockActorData,
-            BlockActorDataPacket(
-                NetworkBlockPosition(x + 1, y, z), block_nbt
-            ).serialize(),
+            BlockActorDataPacket(data.pos, block_nbt).serialize(),
+        )
+    ]
+    if pair_nbt is not None:
+        pair_nbt["x"] = x + 1
+        pair_nbt["y"] = y
+        pair_nbt["z"] = z
+        pair_nbt["pairx"] = x
+        pair_nbt["pairz"] = z
+        packets.append(
+            (
+                MinecraftPacketIds.BlockActorData,
+                BlockActorDataPacket(data.pair_pos, pair_nbt).serialize(),
+            )
         )
+    return packets
+
+
+def send_packet_batch(
+    player: Player, packets: List[Tuple[MinecraftPacketIds, bytes]]
+) -> None:
+    send_packets = getattr(player, "send_packets", None)
+    if send_packets is not None:
+        send_packets(packets)
+        return
+    for packet_id, payload in packets:
+        player.send_packet(packet_id, payload)
 
 
 def run_delay_task(task: Callable[[], None], delay: int, plugin: Plugin):